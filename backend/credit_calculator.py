@@ -24,4 +24,12 @@ def calculate_credit_cost(design_key: str, features: list) -> dict:
             "design": {design_key: design_cost},
             "features": feature_breakdown
         }
-    }
\ No newline at end of file
+    }
+
+def calculate_publish_charge(wedding: dict, total_cost: int) -> int:
+    """Credits charged to publish a wedding at the given total cost"""
+    if wedding.get("published_at"):
+        # This is an upgrade - only charge the difference
+        previous_cost = wedding.get("total_credit_cost", 0)
+        return max(0, total_cost - previous_cost)
+    return total_cost
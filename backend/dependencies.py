@@ -1,6 +1,7 @@
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from auth_utils import verify_token
+from loaders import get_loaders
 from models import AdminRole
 
 security = HTTPBearer()
@@ -9,7 +10,13 @@ async def get_current_admin(
     request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    token = credentials.credentials
+    return await authenticate_token(request, credentials.credentials)
+
+async def authenticate_token(connection, token: str) -> dict:
+    """Resolve a bearer token to its admin document.
+
+    ``connection`` is the Request or WebSocket whose loaders cache the admin.
+    """
     payload = verify_token(token)
     
     if not payload:
@@ -26,8 +33,7 @@ async def get_current_admin(
         )
     
     # Fetch admin from database
-    db = request.app.state.db
-    admin = await db.admins.find_one({"id": admin_id})
+    admin = await get_loaders(connection).admins.load(admin_id)
     
     if not admin:
         raise HTTPException(
@@ -0,0 +1,49 @@
+import hashlib
+from fastapi import Request, Response, status
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag from the given version parts"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check the request's If-None-Match header against an ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+def wedding_etag(wedding: dict) -> str:
+    return make_etag("wedding", wedding["id"], wedding.get("version", 0), wedding["updated_at"].isoformat())
+
+def weddings_list_etag(scope: str, version, include_archived: bool = False) -> str:
+    return make_etag("weddings", scope, version, include_archived)
+
+WEDDINGS_COUNTER_ID = "weddings"
+
+async def get_all_weddings_version(db) -> int:
+    """Version of the super-admin wedding list, bumped on every wedding write"""
+    counter = await db.counters.find_one({"_id": WEDDINGS_COUNTER_ID})
+    return counter["version"] if counter else 0
+
+async def bump_weddings_version(db, admin_id: str, loaders=None):
+    """Invalidate cached wedding lists for the owner and the super admin.
+
+    The shared counter is one hot document for all wedding writes; unlike
+    updated_at or document counts it changes on every write, so a 304 is
+    never served for a list that changed.
+    """
+    await db.admins.update_one({"id": admin_id}, {"$inc": {"weddings_version": 1}})
+    await db.counters.update_one(
+        {"_id": WEDDINGS_COUNTER_ID},
+        {"$inc": {"version": 1}},
+        upsert=True
+    )
+    if loaders is not None:
+        loaders.admins.clear(admin_id)
@@ -0,0 +1,291 @@
+import asyncio
+import contextvars
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+# How long a claim stays valid without being renewed; its owner renews it
+# while running, so an expired lease means the owner died and a retry may
+# take the key over
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+
+# Requests currently executing in this process, keyed by (scope, key), so
+# concurrent duplicates can await the result instead of polling MongoDB.
+_in_flight: Dict[tuple, asyncio.Future] = {}
+
+# The key claimed by the request running in this context, see begin_writes
+_current_claim: contextvars.ContextVar = contextvars.ContextVar("idempotency_claim", default=None)
+
+class _Claim:
+    def __init__(self, db, scope: str, key: str, owner: str):
+        self.db = db
+        self.scope = scope
+        self.key = key
+        self.owner = owner
+        self.writes_started = False
+
+    def filter(self) -> dict:
+        """Matches the record only while this request still holds it"""
+        return {"scope": self.scope, "key": self.key, "owner": self.owner, "state": IN_PROGRESS}
+
+async def begin_writes():
+    """Record that the idempotent handler is about to make changes.
+
+    Handlers call this before their first write. After it, a failure no
+    longer releases the key: the error is stored and replayed, so a retry
+    cannot repeat writes that may already have happened. Also extends the
+    lease, and raises 409 if the key was taken over by another request.
+    """
+    claim = _current_claim.get()
+    if claim is None or claim.writes_started:
+        return
+    result = await claim.db.idempotency_keys.update_one(
+        claim.filter(),
+        {"$set": {"writes_started": True, "locked_until": _lease_expiry()}}
+    )
+    if result.matched_count == 0:
+        # Another request took the key over and may be running the same writes
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still being processed"
+        )
+    claim.writes_started = True
+
+async def ensure_indexes(db):
+    """Create the unique key index and the TTL index for stored keys"""
+    await db.idempotency_keys.create_index(
+        [("scope", 1), ("key", 1)], unique=True
+    )
+    await db.idempotency_keys.create_index(
+        "created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS
+    )
+
+def _lease_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+
+async def _renew_lease(claim: _Claim):
+    """Keep extending the lease while the handler runs"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+        try:
+            result = await claim.db.idempotency_keys.update_one(
+                claim.filter(), {"$set": {"locked_until": _lease_expiry()}}
+            )
+        except Exception as e:
+            print(f"Failed to renew idempotency lease for {claim.scope}/{claim.key}: {e}")
+            continue
+        if result.matched_count == 0:
+            print(f"Lost idempotency claim for {claim.scope}/{claim.key}")
+            return
+
+def _replay(record: dict):
+    """Return the stored response, or re-raise the stored client error"""
+    if record["status_code"] >= 400:
+        raise HTTPException(
+            status_code=record["status_code"],
+            detail=record["response"].get("detail")
+        )
+    return record["response"]
+
+def _check_fingerprint(record: dict, fingerprint: str):
+    if record.get("fingerprint") != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used with a different request"
+        )
+
+async def _take_over_expired(db, record: dict, owner: str):
+    """Handle a claim whose lease ran out.
+
+    Returns "claimed" if this request now owns the key, the settled record if
+    the dead owner had already started writing, or None if another request
+    got there first.
+    """
+    expired = {
+        "scope": record["scope"],
+        "key": record["key"],
+        "state": IN_PROGRESS,
+        "locked_until": record["locked_until"]
+    }
+    if record.get("writes_started"):
+        # The dead owner may have written, so the request must not be re-run
+        return await db.idempotency_keys.find_one_and_update(
+            expired,
+            {
+                "$set": {
+                    "state": COMPLETED,
+                    "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "response": {"detail": "Request was interrupted after making changes; it will not be re-run for this Idempotency-Key"},
+                    "completed_at": datetime.utcnow()
+                }
+            },
+            return_document=ReturnDocument.AFTER
+        )
+    taken = await db.idempotency_keys.find_one_and_update(
+        expired,
+        {"$set": {"owner": owner, "locked_until": _lease_expiry()}}
+    )
+    return "claimed" if taken else None
+
+async def _claim_or_wait(db, scope: str, key: str, fingerprint: str, owner: str):
+    """Claim the key for owner, or wait for the request holding it.
+
+    Returns None once this request owns the key, otherwise the completed
+    record to replay.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.utcnow()
+        try:
+            await db.idempotency_keys.insert_one({
+                "scope": scope,
+                "key": key,
+                "fingerprint": fingerprint,
+                "owner": owner,
+                "state": IN_PROGRESS,
+                "locked_until": now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+                "created_at": now
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        record = await db.idempotency_keys.find_one({"scope": scope, "key": key})
+        if record is None:
+            # The owner failed before writing and released the key
+            continue
+        _check_fingerprint(record, fingerprint)
+        if record["state"] == COMPLETED:
+            return record
+
+        if record["locked_until"] <= now:
+            result = await _take_over_expired(db, record, owner)
+            if result == "claimed":
+                return None
+            if result is not None:
+                return result
+            continue
+
+        if loop.time() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed"
+            )
+
+        # Wake up as soon as an owner in this process finishes; the owner
+        # may also live in another worker process, so fall back to polling
+        future = _in_flight.get((scope, key))
+        if future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+async def run_idempotent(
+    db,
+    scope: str,
+    key: Optional[str],
+    fingerprint: str,
+    handler: Callable[[], Awaitable[dict]]
+) -> dict:
+    """Run handler at most once per (scope, key) and replay its response.
+
+    The first request claims the key by inserting an IN_PROGRESS record and
+    stores its response when done. Retries with the same key get the stored
+    response; concurrent duplicates wait for the in-flight request, and take
+    the key over if its owner stopped renewing its lease
+    (IDEMPOTENCY_LEASE_SECONDS). Results are only stored while the claim is
+    still held, so a request whose key was taken over cannot overwrite it. Client
+    errors (4xx) are stored and replayed. Server errors release the key so the
+    client can retry, unless the handler already called begin_writes, in which
+    case the error is stored instead.
+    """
+    if not key:
+        return await handler()
+
+    owner = uuid.uuid4().hex
+    record = await _claim_or_wait(db, scope, key, fingerprint, owner)
+    if record is not None:
+        return _replay(record)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[(scope, key)] = future
+    claim = _Claim(db, scope, key, owner)
+    token = _current_claim.set(claim)
+    heartbeat = asyncio.create_task(_renew_lease(claim))
+    try:
+        try:
+            response = jsonable_encoder(await handler())
+        except HTTPException as e:
+            if e.status_code < 500 or claim.writes_started:
+                await _settle_failure(claim, e.status_code, e.detail)
+            else:
+                await _release(claim)
+            raise
+        except BaseException:
+            if claim.writes_started:
+                await _settle_failure(
+                    claim, status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "Request failed after making changes; it will not be re-run for this Idempotency-Key"
+                )
+            else:
+                await _release(claim)
+            raise
+
+        try:
+            await _complete(claim, status.HTTP_200_OK, response)
+        except Exception as e:
+            # The writes succeeded, so answer the client; the record keeps
+            # writes_started and will not be re-run
+            print(f"Failed to store idempotent response for {scope}/{key}: {e}")
+        return response
+    finally:
+        heartbeat.cancel()
+        _current_claim.reset(token)
+        _in_flight.pop((scope, key), None)
+        if not future.done():
+            future.set_result(None)
+
+async def _settle_failure(claim: _Claim, status_code: int, detail):
+    try:
+        await _complete(claim, status_code, {"detail": detail})
+    except Exception as e:
+        print(f"Failed to store idempotent error for {claim.scope}/{claim.key}: {e}")
+
+async def _release(claim: _Claim):
+    """Drop the claim so a retry can run; only safe before any writes"""
+    try:
+        await claim.db.idempotency_keys.delete_one(claim.filter())
+    except Exception as e:
+        print(f"Failed to release idempotency key {claim.scope}/{claim.key}: {e}")
+
+async def _complete(claim: _Claim, status_code: int, response: dict):
+    result = await claim.db.idempotency_keys.update_one(
+        claim.filter(),
+        {
+            "$set": {
+                "state": COMPLETED,
+                "status_code": status_code,
+                "response": response,
+                "completed_at": datetime.utcnow()
+            }
+        }
+    )
+    if result.matched_count == 0:
+        # Taken over (or settled) by another request after the lease expired
+        print(f"Idempotency claim for {claim.scope}/{claim.key} was lost; response not stored")
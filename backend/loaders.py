@@ -0,0 +1,84 @@
+import asyncio
+from typing import Dict, List, Optional, Set
+
+class DocumentLoader:
+    """Memoizing loader for one collection, scoped to a single request.
+
+    Loads issued in the same event-loop tick are coalesced into one
+    ``{"id": {"$in": [...]}}`` query. Results (including misses) are cached
+    until cleared, so writes must call ``clear`` or ``prime``.
+    """
+
+    def __init__(self, collection, key: str = "id"):
+        self._collection = collection
+        self._key = key
+        self._cache: Dict[str, asyncio.Future] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        # The event loop only keeps weak references to tasks
+        self._dispatch_tasks: Set[asyncio.Task] = set()
+
+    async def load(self, doc_id: str) -> Optional[dict]:
+        # A pending load has not been sent yet, so it is still fresh
+        future = self._cache.get(doc_id) or self._pending.get(doc_id)
+        if future is not None:
+            self._cache[doc_id] = future
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._cache[doc_id] = future
+            if not self._pending:
+                loop.call_soon(self._start_dispatch)
+            self._pending[doc_id] = future
+        return await asyncio.shield(future)
+
+    async def load_many(self, doc_ids: List[str]) -> List[Optional[dict]]:
+        return list(await asyncio.gather(*(self.load(doc_id) for doc_id in doc_ids)))
+
+    def prime(self, doc: dict):
+        """Cache a document the caller already has, e.g. after a write"""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(doc)
+        self._cache[doc[self._key]] = future
+
+    def clear(self, doc_id: str):
+        self._cache.pop(doc_id, None)
+
+    def _start_dispatch(self):
+        task = asyncio.ensure_future(self._dispatch())
+        self._dispatch_tasks.add(task)
+        task.add_done_callback(self._dispatch_tasks.discard)
+
+    async def _dispatch(self):
+        futures, self._pending = self._pending, {}
+        doc_ids = list(futures)
+        try:
+            if len(doc_ids) == 1:
+                docs = [await self._collection.find_one({self._key: doc_ids[0]})]
+            else:
+                docs = await self._collection.find(
+                    {self._key: {"$in": doc_ids}}
+                ).to_list(length=None)
+        except Exception as e:
+            for doc_id, future in futures.items():
+                if self._cache.get(doc_id) is future:
+                    del self._cache[doc_id]
+                future.set_exception(e)
+            return
+
+        found = {doc[self._key]: doc for doc in docs if doc}
+        for doc_id, future in futures.items():
+            if not future.done():
+                future.set_result(found.get(doc_id))
+
+class RequestLoaders:
+    def __init__(self, db):
+        self.admins = DocumentLoader(db.admins)
+        self.weddings = DocumentLoader(db.weddings)
+
+def get_loaders(request) -> RequestLoaders:
+    """Return the loaders for this request (or WebSocket), creating them on first use"""
+    loaders = getattr(request.state, "loaders", None)
+    if loaders is None:
+        loaders = RequestLoaders(request.app.state.db)
+        request.state.loaders = loaders
+    return loaders
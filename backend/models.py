@@ -26,6 +26,7 @@ class Admin(BaseModel):
     full_name: str
     role: AdminRole = AdminRole.ADMIN
     available_credits: int = 100  # Default starting credits
+    weddings_version: int = 0  # Bumped on every wedding write, drives list ETags
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -58,6 +59,7 @@ class Wedding(BaseModel):
     selected_features: List[str] = Field(default_factory=list)
     total_credit_cost: int = 0
     published_at: Optional[datetime] = None
+    version: int = 1
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -133,4 +135,10 @@ class CreditConfig(BaseModel):
         "video": 15,
         "live_streaming": 25,
         "gift_registry": 10
-    }
\ No newline at end of file
+    }
+# Profiler Models
+class ProfilerSettingsUpdate(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    slow_threshold_ms: Optional[float] = Field(None, ge=0)
+    interval_ms: Optional[float] = Field(None, ge=1, le=1000)
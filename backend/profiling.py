@@ -0,0 +1,328 @@
+"""On-demand request profiling.
+
+ProfilingMiddleware is a pass-through until a super admin enables the
+profiler. While enabled, a fraction of requests (``sample_rate``) is profiled
+by a background thread that samples the event loop's stack every
+``interval_ms``. Samples for a request that is not running at that moment
+record where it is suspended, marked with ``[await]``, so the result is a
+wall-clock profile. Every request also records the Mongo commands it issues.
+Sampled requests and any request slower than ``slow_threshold_ms`` are
+written to ``PROFILER_CAPTURE_DIR`` as a ``.json`` summary plus, when stack
+samples were taken, a collapsed-stack ``.folded`` file (flamegraph.pl /
+speedscope input). Only the newest ``PROFILER_MAX_CAPTURES`` captures are kept.
+
+Settings live in the ``profiler_settings`` collection so every worker
+process follows the same toggle; each worker re-reads them at most every
+``PROFILER_SETTINGS_POLL_SECONDS``. Workers on one host share the capture
+directory; on several hosts each host keeps its own captures.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+from pymongo import ReturnDocument, monitoring
+
+PROFILER_CAPTURE_DIR = os.getenv(
+    "PROFILER_CAPTURE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+)
+PROFILER_SETTINGS_POLL_SECONDS = float(os.getenv("PROFILER_SETTINGS_POLL_SECONDS", "5"))
+SETTINGS_DOC_ID = "profiler"
+SETTING_NAMES = ("enabled", "sample_rate", "slow_threshold_ms", "interval_ms")
+PROFILER_MAX_CAPTURES = int(os.getenv("PROFILER_MAX_CAPTURES", "50"))
+
+CAPTURE_ID_PATTERN = re.compile(r"^[0-9]+-[a-z]+-[0-9a-f]{8}$")
+
+_current_capture: contextvars.ContextVar = contextvars.ContextVar("profiling_capture", default=None)
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _awaiting_stack(coro) -> List[str]:
+    """Labels for a suspended coroutine chain, outermost first"""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return labels
+
+class RequestCapture:
+    def __init__(self, scope: dict, profiled: bool):
+        self.timestamp_ms = int(time.time() * 1000)
+        self.suffix = uuid.uuid4().hex[:8]
+        self.method = scope.get("method")
+        self.path = scope.get("path")
+        self.profiled = profiled
+        self.task = asyncio.current_task()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.commands: List[dict] = []
+        self._pending_commands: Dict[int, dict] = {}
+        self.status_code: Optional[int] = None
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+
+    def command_started(self, event):
+        # Most commands name their collection as the command's value
+        target = event.command.get(event.command_name)
+        self._pending_commands[event.request_id] = {
+            "command": event.command_name,
+            "collection": target if isinstance(target, str) else None
+        }
+
+    def command_finished(self, event, failed: bool):
+        command = self._pending_commands.pop(event.request_id, {"command": event.command_name, "collection": None})
+        command["duration_ms"] = event.duration_micros / 1000
+        command["failed"] = failed
+        self.commands.append(command)
+
+    def summary(self, capture_id: str) -> dict:
+        return {
+            "id": capture_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3),
+            "profiled": self.profiled,
+            "samples": self.samples,
+            "mongo_commands": len(self.commands),
+            "mongo_time_ms": round(sum(c["duration_ms"] for c in self.commands), 3),
+            "commands": self.commands
+        }
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Attributes Mongo command timings to the capture of the issuing request"""
+
+    def started(self, event):
+        capture = _current_capture.get()
+        if capture is not None:
+            capture.command_started(event)
+
+    def succeeded(self, event):
+        capture = _current_capture.get()
+        if capture is not None:
+            capture.command_finished(event, failed=False)
+
+    def failed(self, event):
+        capture = _current_capture.get()
+        if capture is not None:
+            capture.command_finished(event, failed=True)
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = float(os.getenv("PROFILER_SAMPLE_RATE", "0.01"))
+        self.slow_threshold_ms = float(os.getenv("PROFILER_SLOW_THRESHOLD_MS", "1000"))
+        self.interval_ms = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+        self.capture_dir = PROFILER_CAPTURE_DIR
+        self.max_captures = PROFILER_MAX_CAPTURES
+        self._active: Dict[int, RequestCapture] = {}
+        self._loop_thread_id: Optional[int] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._settings_checked = float("-inf")
+        self._settings_refresh: Optional[asyncio.Task] = None
+
+    def settings(self) -> dict:
+        return {name: getattr(self, name) for name in SETTING_NAMES}
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if name in SETTING_NAMES and value is not None:
+                setattr(self, name, value)
+
+    async def save_settings(self, db, **settings) -> dict:
+        """Store changed settings in the shared document and apply the result"""
+        changes = {name: value for name, value in settings.items() if value is not None}
+        doc = await db.profiler_settings.find_one_and_update(
+            {"_id": SETTINGS_DOC_ID},
+            {"$set": changes} if changes else {"$setOnInsert": {}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.configure(**doc)
+        self._settings_checked = time.monotonic()
+        return self.settings()
+
+    async def load_settings(self, db):
+        try:
+            doc = await db.profiler_settings.find_one({"_id": SETTINGS_DOC_ID})
+        except Exception as e:
+            print(f"Failed to load profiler settings: {e}")
+            return
+        if doc:
+            self.configure(**doc)
+
+    def poll_settings(self, db):
+        """Refresh settings in the background when the poll interval has passed"""
+        now = time.monotonic()
+        if now - self._settings_checked < PROFILER_SETTINGS_POLL_SECONDS:
+            return
+        if self._settings_refresh is not None and not self._settings_refresh.done():
+            return
+        self._settings_checked = now
+        self._settings_refresh = asyncio.create_task(self.load_settings(db))
+
+    def start_capture(self, scope: dict) -> RequestCapture:
+        self._loop_thread_id = threading.get_ident()
+        capture = RequestCapture(scope, profiled=random.random() < self.sample_rate)
+        if capture.profiled:
+            with self._lock:
+                self._active[id(capture)] = capture
+                if self._sampler is None or not self._sampler.is_alive():
+                    self._sampler = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+                    self._sampler.start()
+        return capture
+
+    def finish_capture(self, capture: RequestCapture):
+        capture.duration_ms = (time.perf_counter() - capture.started) * 1000
+        with self._lock:
+            self._active.pop(id(capture), None)
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval_ms / 1000)
+            with self._lock:
+                captures = list(self._active.values())
+                if not captures:
+                    self._sampler = None
+                    return
+            frame = sys._current_frames().get(self._loop_thread_id)
+            running = []
+            while frame is not None:
+                running.append(frame)
+                frame = frame.f_back
+            running.reverse()
+            positions = {id(frame): index for index, frame in enumerate(running)}
+
+            for capture in captures:
+                coro = capture.task.get_coro() if capture.task else None
+                root = getattr(coro, "cr_frame", None)
+                if root is not None and id(root) in positions:
+                    stack = [_frame_label(frame) for frame in running[positions[id(root)]:]]
+                else:
+                    stack = _awaiting_stack(coro) + ["[await]"]
+                capture.stacks[";".join(stack)] += 1
+                capture.samples += 1
+
+    def should_store(self, capture: RequestCapture) -> Optional[str]:
+        if capture.duration_ms >= self.slow_threshold_ms:
+            return "slow"
+        if capture.profiled:
+            return "sampled"
+        return None
+
+    def store(self, capture: RequestCapture, reason: str) -> str:
+        """Write a capture to disk and trim the ring buffer (blocking)"""
+        os.makedirs(self.capture_dir, exist_ok=True)
+        capture_id = f"{capture.timestamp_ms}-{reason}-{capture.suffix}"
+        base = os.path.join(self.capture_dir, capture_id)
+        # Slow requests that were not sampled have Mongo timings but no stacks
+        if capture.stacks:
+            with open(base + ".folded", "w") as f:
+                for stack, count in capture.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        with open(base + ".json", "w") as f:
+            json.dump(capture.summary(capture_id), f, indent=2)
+
+        capture_ids = self.list_capture_ids()
+        for stale_id in capture_ids[:-self.max_captures] if self.max_captures > 0 else capture_ids:
+            for extension in (".folded", ".json"):
+                try:
+                    os.remove(os.path.join(self.capture_dir, stale_id + extension))
+                except FileNotFoundError:
+                    pass
+        return capture_id
+
+    def list_capture_ids(self) -> List[str]:
+        """Capture ids on disk, oldest first"""
+        if not os.path.isdir(self.capture_dir):
+            return []
+        capture_ids = [
+            name[:-len(".json")] for name in os.listdir(self.capture_dir)
+            if name.endswith(".json") and CAPTURE_ID_PATTERN.match(name[:-len(".json")])
+        ]
+        return sorted(capture_ids, key=lambda capture_id: int(capture_id.split("-", 1)[0]))
+
+    def list_captures(self) -> List[dict]:
+        """Capture summaries without command lists, newest first (blocking)"""
+        captures = []
+        for capture_id in reversed(self.list_capture_ids()):
+            summary = self.read_capture(capture_id)
+            if summary is None:
+                continue
+            summary.pop("commands", None)
+            captures.append(summary)
+        return captures
+
+    def read_capture(self, capture_id: str) -> Optional[dict]:
+        """Full capture summary, or None if it is missing (blocking)"""
+        path = self.capture_path(capture_id, ".json")
+        if not path:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            # Trimmed by another worker or still being written
+            return None
+
+    def capture_path(self, capture_id: str, extension: str) -> Optional[str]:
+        """Path of an existing capture file, or None (blocking)"""
+        if not CAPTURE_ID_PATTERN.match(capture_id):
+            return None
+        path = os.path.join(self.capture_dir, capture_id + extension)
+        return path if os.path.isfile(path) else None
+
+profiler = Profiler()
+
+class ProfilingMiddleware:
+    """ASGI middleware that feeds HTTP requests to the profiler when enabled"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            db = getattr(scope["app"].state, "db", None) if "app" in scope else None
+            if db is not None:
+                profiler.poll_settings(db)
+
+        if scope["type"] != "http" or not profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        capture = profiler.start_capture(scope)
+        token = _current_capture.set(capture)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                capture.status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_capture.reset(token)
+            profiler.finish_capture(capture)
+            reason = profiler.should_store(capture)
+            if reason:
+                try:
+                    await asyncio.to_thread(profiler.store, capture, reason)
+                except OSError as e:
+                    print(f"Failed to store profile capture: {e}")
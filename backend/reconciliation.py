@@ -0,0 +1,213 @@
+"""Reconcile admins.available_credits against the credit_ledger chain.
+
+Each admin's ledger is streamed in created_at order and every entry's
+balance_after is checked against the previous entry plus its amount. The
+final balance_after is compared with the admin's available_credits, and
+negative balances are reported for both ledger entries and admins. Admins
+are processed concurrently by a bounded pool of workers, so memory use does
+not depend on ledger size.
+
+Run from the backend directory:
+
+    python reconciliation.py [--repair] [--concurrency N]
+"""
+import asyncio
+import time
+from datetime import datetime
+from models import CreditLedger, CreditTransactionType
+
+DEFAULT_CONCURRENCY = 8
+LEDGER_BATCH_SIZE = 1000
+MAX_REPORTED_ISSUES = 1000
+
+async def ensure_indexes(db):
+    """Index used to stream each admin's ledger in order.
+
+    Includes _id so the (created_at, _id) sort is read from the index in
+    either direction instead of sorting an admin's whole ledger in memory.
+    """
+    await db.credit_ledger.create_index([("admin_id", 1), ("created_at", 1), ("_id", 1)])
+
+def _signed_amount(entry: dict) -> int:
+    if entry["transaction_type"] == CreditTransactionType.DEDUCT:
+        return -entry["amount"]
+    return entry["amount"]
+
+class ReconciliationReport:
+    def __init__(self):
+        self.admins_checked = 0
+        self.ledger_entries_scanned = 0
+        self.drift_count = 0
+        self.gap_count = 0
+        self.negative_count = 0
+        self.repaired = 0
+        self.issues = []
+        self.issues_truncated = False
+        self.started = time.monotonic()
+
+    def add_issue(self, issue: dict):
+        if len(self.issues) < MAX_REPORTED_ISSUES:
+            self.issues.append(issue)
+        else:
+            self.issues_truncated = True
+
+    def as_dict(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "admins_checked": self.admins_checked,
+            "ledger_entries_scanned": self.ledger_entries_scanned,
+            "admins_with_drift": self.drift_count,
+            "gaps": self.gap_count,
+            "negative_balances": self.negative_count,
+            "repaired": self.repaired,
+            "issues": self.issues,
+            "issues_truncated": self.issues_truncated,
+            "elapsed_seconds": round(elapsed, 3),
+            "entries_per_second": round(self.ledger_entries_scanned / elapsed, 1) if elapsed else 0.0,
+            "admins_per_second": round(self.admins_checked / elapsed, 1) if elapsed else 0.0
+        }
+
+async def _reconcile_admin(db, admin: dict, report: ReconciliationReport, repair: bool):
+    admin_id = admin["id"]
+    previous = None
+    cursor = db.credit_ledger.find(
+        {"admin_id": admin_id},
+        {"_id": 0, "id": 1, "transaction_type": 1, "amount": 1, "balance_after": 1, "created_at": 1}
+    ).sort([("created_at", 1), ("_id", 1)]).batch_size(LEDGER_BATCH_SIZE)
+
+    async for entry in cursor:
+        report.ledger_entries_scanned += 1
+
+        if previous is not None:
+            expected = previous["balance_after"] + _signed_amount(entry)
+            if entry["balance_after"] != expected:
+                report.gap_count += 1
+                report.add_issue({
+                    "type": "gap",
+                    "admin_id": admin_id,
+                    "entry_id": entry["id"],
+                    "expected_balance_after": expected,
+                    "balance_after": entry["balance_after"]
+                })
+
+        if entry["balance_after"] < 0:
+            report.negative_count += 1
+            report.add_issue({
+                "type": "negative_balance",
+                "admin_id": admin_id,
+                "entry_id": entry["id"],
+                "balance_after": entry["balance_after"]
+            })
+
+        previous = entry
+
+    report.admins_checked += 1
+
+    # Checked separately so admins without ledger entries are covered too
+    if admin["available_credits"] < 0:
+        report.negative_count += 1
+        report.add_issue({
+            "type": "negative_balance",
+            "admin_id": admin_id,
+            "available_credits": admin["available_credits"]
+        })
+
+    # Without any ledger entries there is no chain to compare against
+    if previous is None or previous["balance_after"] == admin["available_credits"]:
+        return
+
+    report.drift_count += 1
+    report.add_issue({
+        "type": "drift",
+        "admin_id": admin_id,
+        "available_credits": admin["available_credits"],
+        "ledger_balance": previous["balance_after"]
+    })
+
+    if repair:
+        if await _repair_drift(db, admin_id, admin["available_credits"], previous):
+            report.repaired += 1
+
+async def _repair_drift(db, admin_id: str, available_credits: int, last_entry: dict) -> bool:
+    """Append an adjustment entry so the ledger ends at available_credits.
+
+    The balance is treated as authoritative: the writes in publish_wedding and
+    add_credits update it before inserting the ledger entry, so drift means a
+    ledger entry is missing. Skips the repair if the admin or ledger changed
+    while reconciling.
+    """
+    admin = await db.admins.find_one({"id": admin_id}, {"_id": 0, "available_credits": 1})
+    latest = await db.credit_ledger.find_one(
+        {"admin_id": admin_id}, {"_id": 0, "id": 1},
+        sort=[("created_at", -1), ("_id", -1)]
+    )
+    if not admin or admin["available_credits"] != available_credits or not latest or latest["id"] != last_entry["id"]:
+        return False
+
+    difference = available_credits - last_entry["balance_after"]
+    adjustment = CreditLedger(
+        admin_id=admin_id,
+        transaction_type=CreditTransactionType.CREDIT if difference > 0 else CreditTransactionType.DEDUCT,
+        amount=abs(difference),
+        balance_after=available_credits,
+        description="Reconciliation adjustment",
+        created_at=max(datetime.utcnow(), last_entry["created_at"])
+    )
+    await db.credit_ledger.insert_one(adjustment.dict())
+    return True
+
+async def reconcile_ledger(db, concurrency: int = DEFAULT_CONCURRENCY, repair: bool = False) -> dict:
+    """Check every admin's ledger chain, optionally repairing balance drift"""
+    report = ReconciliationReport()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            admin = await queue.get()
+            try:
+                if admin is None:
+                    return
+                await _reconcile_admin(db, admin, report, repair)
+            except Exception as e:
+                report.add_issue({"type": "error", "admin_id": admin["id"], "detail": str(e)})
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        async for admin in db.admins.find({}, {"_id": 0, "id": 1, "available_credits": 1}):
+            await queue.put(admin)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+    return report.as_dict()
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import os
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Reconcile admin balances against the credit ledger")
+    parser.add_argument("--repair", action="store_true", help="append adjustment entries for balance drift")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="number of admins processed at once")
+    args = parser.parse_args()
+
+    async def main():
+        client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+        try:
+            db = client[os.getenv("DATABASE_NAME", "wedding_platform")]
+            await ensure_indexes(db)
+            report = await reconcile_ledger(db, concurrency=args.concurrency, repair=args.repair)
+            print(json.dumps(report, indent=2, default=str))
+        finally:
+            client.close()
+
+    asyncio.run(main())
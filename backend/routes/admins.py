@@ -1,7 +1,11 @@
-from fastapi import APIRouter, HTTPException, status, Request, Depends
+from fastapi import APIRouter, HTTPException, status, Request, Depends, Header, Query
+from pymongo import ReturnDocument
 from models import AdminResponse
 from dependencies import get_current_admin, get_super_admin
-from typing import List
+from idempotency import run_idempotent, begin_writes
+from loaders import get_loaders
+from reconciliation import reconcile_ledger, DEFAULT_CONCURRENCY
+from typing import List, Optional
 
 router = APIRouter()
 
@@ -15,38 +19,59 @@ async def list_admins(
     admins = await db.admins.find().to_list(length=None)
     return [AdminResponse(**admin) for admin in admins]
 
+@router.post("/reconcile", response_model=dict)
+async def reconcile_credits(
+    request: Request,
+    repair: bool = False,
+    concurrency: int = Query(DEFAULT_CONCURRENCY, ge=1, le=64),
+    current_admin: dict = Depends(get_super_admin)
+):
+    """Check balances against the credit ledger (Super Admin only)"""
+    db = request.app.state.db
+    return await reconcile_ledger(db, concurrency=concurrency, repair=repair)
+
 @router.post("/{admin_id}/credits", response_model=dict)
 async def add_credits(
     admin_id: str,
     amount: int,
     request: Request,
-    current_admin: dict = Depends(get_super_admin)
+    current_admin: dict = Depends(get_super_admin),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """Add credits to an admin account (Super Admin only)"""
+    db = request.app.state.db
+    
+    return await run_idempotent(
+        db,
+        scope=f"admins.add_credits:{current_admin['id']}",
+        key=idempotency_key,
+        fingerprint=f"{admin_id}:{amount}",
+        handler=lambda: _add_credits(db, get_loaders(request), admin_id, amount, current_admin)
+    )
+
+async def _add_credits(db, loaders, admin_id: str, amount: int, current_admin: dict) -> dict:
     from models import CreditLedger, CreditTransactionType
     from datetime import datetime
     
-    db = request.app.state.db
+    # Past this point a failed request must not be re-run for its key
+    await begin_writes()
     
-    # Find admin
-    admin = await db.admins.find_one({"id": admin_id})
+    # Update admin credits atomically
+    admin = await db.admins.find_one_and_update(
+        {"id": admin_id},
+        {
+            "$inc": {"available_credits": amount},
+            "$set": {"updated_at": datetime.utcnow()}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    loaders.admins.clear(admin_id)
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Admin not found"
         )
-    
-    # Update admin credits
-    new_balance = admin["available_credits"] + amount
-    await db.admins.update_one(
-        {"id": admin_id},
-        {
-            "$set": {
-                "available_credits": new_balance,
-                "updated_at": datetime.utcnow()
-            }
-        }
-    )
+    new_balance = admin["available_credits"]
     
     # Create ledger entry
     ledger_entry = CreditLedger(
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, HTTPException, status, Request, Depends
+from fastapi import APIRouter, HTTPException, status, Request, Response, Depends
 from models import CreditLedger
 from dependencies import get_current_admin
+from credit_calculator import credit_config
+from etags import make_etag, etag_matches, not_modified
 from typing import List
 
 router = APIRouter()
 
+# Pricing is static for the lifetime of the process
+CREDIT_CONFIG_ETAG = make_etag("credit-config", sorted(credit_config.designs.items()), sorted(credit_config.features.items()))
+
 @router.get("/ledger", response_model=List[dict])
 async def get_credit_ledger(
     request: Request,
@@ -22,12 +27,17 @@ async def get_credit_ledger(
 @router.get("/balance", response_model=dict)
 async def get_credit_balance(
     request: Request,
+    response: Response,
     current_admin: dict = Depends(get_current_admin)
 ):
     """Get current credit balance"""
-    db = request.app.state.db
+    # get_current_admin has just loaded the admin, so no second read is needed
+    admin = current_admin
     
-    admin = await db.admins.find_one({"id": current_admin["id"]})
+    etag = make_etag("balance", admin["id"], admin["available_credits"], admin["updated_at"].isoformat())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     
     return {
         "available_credits": admin["available_credits"],
@@ -36,11 +46,12 @@ async def get_credit_balance(
     }
 
 @router.get("/config", response_model=dict)
-async def get_credit_config():
+async def get_credit_config(request: Request, response: Response):
     """Get credit pricing configuration"""
-    from models import CreditConfig
-    config = CreditConfig()
+    if etag_matches(request, CREDIT_CONFIG_ETAG):
+        return not_modified(CREDIT_CONFIG_ETAG)
+    response.headers["ETag"] = CREDIT_CONFIG_ETAG
     return {
-        "designs": config.designs,
-        "features": config.features
+        "designs": credit_config.designs,
+        "features": credit_config.features
     }
\ No newline at end of file
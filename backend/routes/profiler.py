@@ -0,0 +1,62 @@
+from fastapi import APIRouter, HTTPException, status, Request, Depends
+from fastapi.responses import FileResponse
+from models import ProfilerSettingsUpdate
+from dependencies import get_super_admin
+from profiling import profiler
+from typing import List
+import asyncio
+
+router = APIRouter()
+
+@router.get("/settings", response_model=dict)
+async def get_profiler_settings(
+    request: Request,
+    current_admin: dict = Depends(get_super_admin)
+):
+    """Get profiler settings (Super Admin only)"""
+    await profiler.load_settings(request.app.state.db)
+    return profiler.settings()
+
+@router.put("/settings", response_model=dict)
+async def update_profiler_settings(
+    settings: ProfilerSettingsUpdate,
+    request: Request,
+    current_admin: dict = Depends(get_super_admin)
+):
+    """Enable/disable the profiler or change its settings for all workers (Super Admin only)"""
+    return await profiler.save_settings(request.app.state.db, **settings.dict())
+
+@router.get("/captures", response_model=List[dict])
+async def list_captures(current_admin: dict = Depends(get_super_admin)):
+    """List stored captures, newest first (Super Admin only)"""
+    return await asyncio.to_thread(profiler.list_captures)
+
+@router.get("/captures/{capture_id}", response_model=dict)
+async def get_capture(
+    capture_id: str,
+    current_admin: dict = Depends(get_super_admin)
+):
+    """Get a capture's summary including its Mongo command timings (Super Admin only)"""
+    capture = await asyncio.to_thread(profiler.read_capture, capture_id)
+    if capture is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Capture not found"
+        )
+    return capture
+
+@router.get("/captures/{capture_id}/folded")
+async def download_capture(
+    capture_id: str,
+    current_admin: dict = Depends(get_super_admin)
+):
+    """Download a capture's collapsed stacks for flamegraph tools (Super Admin only)"""
+    path = await asyncio.to_thread(profiler.capture_path, capture_id, ".folded")
+    if not path:
+        has_summary = await asyncio.to_thread(profiler.capture_path, capture_id, ".json")
+        detail = "Capture has no stack samples" if has_summary else "Capture not found"
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=detail
+        )
+    return FileResponse(path, media_type="text/plain", filename=f"{capture_id}.folded")
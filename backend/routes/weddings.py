@@ -1,12 +1,25 @@
-from fastapi import APIRouter, HTTPException, status, Request, Depends
+from fastapi import (
+    APIRouter, HTTPException, status, Request, Response, Depends, Header,
+    WebSocket, WebSocketDisconnect
+)
 from models import (
     Wedding, WeddingCreate, WeddingUpdate, WeddingResponse, 
     WeddingStatus, PublishRequest, CreditLedger, CreditTransactionType
 )
-from dependencies import get_current_admin, get_super_admin
-from credit_calculator import calculate_credit_cost
-from typing import List
+from dependencies import get_current_admin, get_super_admin, authenticate_token
+from credit_calculator import calculate_credit_cost, calculate_publish_charge
+from idempotency import run_idempotent, begin_writes
+from loaders import get_loaders
+from wedding_archive import slug_taken, find_wedding, move_to_archive, restore_from_archive
+from etags import (
+    etag_matches, not_modified, wedding_etag, weddings_list_etag,
+    get_all_weddings_version, bump_weddings_version
+)
+from typing import List, Optional
 from datetime import datetime
+import asyncio
+import json
+from pymongo import ReturnDocument
 
 router = APIRouter()
 
@@ -18,10 +31,10 @@ async def create_wedding(
 ):
     """Create a new wedding in DRAFT status"""
     db = request.app.state.db
+    loaders = get_loaders(request)
     
     # Check if slug is unique
-    existing_wedding = await db.weddings.find_one({"slug": wedding_data.slug})
-    if existing_wedding:
+    if await slug_taken(db, wedding_data.slug):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Slug already exists. Please choose a different slug."
@@ -36,36 +49,79 @@ async def create_wedding(
     )
     
     await db.weddings.insert_one(new_wedding.dict())
+    loaders.weddings.prime(new_wedding.dict())
+    await bump_weddings_version(db, current_admin["id"], loaders)
     
     return WeddingResponse(**new_wedding.dict())
 
 @router.get("/", response_model=List[WeddingResponse])
 async def list_weddings(
     request: Request,
+    response: Response,
+    include_archived: bool = False,
     current_admin: dict = Depends(get_current_admin)
 ):
     """List weddings for current admin (or all for super admin)"""
     db = request.app.state.db
     
+    # ETags follow counters bumped on every wedding write: per admin, or
+    # shared for the super admin's list of all weddings
+    if current_admin.get("role") == "SUPER_ADMIN":
+        etag = weddings_list_etag("all", await get_all_weddings_version(db), include_archived)
+    else:
+        etag = weddings_list_etag(current_admin["id"], current_admin.get("weddings_version", 0), include_archived)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    
     # Super admin can see all weddings
     if current_admin.get("role") == "SUPER_ADMIN":
-        weddings = await db.weddings.find().to_list(length=None)
+        query = {}
     else:
         # Regular admin sees only their weddings
-        weddings = await db.weddings.find({"admin_id": current_admin["id"]}).to_list(length=None)
-    
-    return [WeddingResponse(**wedding) for wedding in weddings]
+        query = {"admin_id": current_admin["id"]}
+    
+    if not include_archived:
+        # ARCHIVED weddings the sweep has not moved yet are still hot
+        weddings = await db.weddings.find(
+            {**query, "status": {"$ne": WeddingStatus.ARCHIVED}}
+        ).to_list(length=None)
+        return [WeddingResponse(**wedding) for wedding in weddings]
+    
+    archived = await db.weddings_archive.find(query).to_list(length=None)
+    archived_ids = {wedding["id"] for wedding in archived}
+    # An interrupted move can leave a wedding in both collections
+    weddings = [
+        wedding for wedding in await db.weddings.find(query).to_list(length=None)
+        if wedding["id"] not in archived_ids
+    ]
+    
+    return [WeddingResponse(**wedding) for wedding in weddings + archived]
 
 @router.get("/{wedding_id}", response_model=WeddingResponse)
 async def get_wedding(
     wedding_id: str,
     request: Request,
+    response: Response,
     current_admin: dict = Depends(get_current_admin)
 ):
     """Get a specific wedding"""
     db = request.app.state.db
     
-    wedding = await db.weddings.find_one({"id": wedding_id})
+    # Revalidate against version fields only before loading the full document
+    if request.headers.get("if-none-match"):
+        stamp = await find_wedding(
+            db, wedding_id,
+            {"_id": 0, "id": 1, "admin_id": 1, "version": 1, "updated_at": 1}
+        )
+        if stamp and (current_admin.get("role") == "SUPER_ADMIN" or stamp["admin_id"] == current_admin["id"]):
+            etag = wedding_etag(stamp)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+    
+    wedding = await get_loaders(request).weddings.load(wedding_id)
+    if not wedding:
+        wedding = await db.weddings_archive.find_one({"id": wedding_id})
     if not wedding:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -79,6 +135,7 @@ async def get_wedding(
             detail="Access denied"
         )
     
+    response.headers["ETag"] = wedding_etag(wedding)
     return WeddingResponse(**wedding)
 
 @router.put("/{wedding_id}", response_model=WeddingResponse)
@@ -90,9 +147,10 @@ async def update_wedding(
 ):
     """Update a wedding"""
     db = request.app.state.db
+    loaders = get_loaders(request)
     
     # Find wedding
-    wedding = await db.weddings.find_one({"id": wedding_id})
+    wedding = await loaders.weddings.load(wedding_id)
     if not wedding:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -106,10 +164,16 @@ async def update_wedding(
             detail="Access denied"
         )
     
+    # Archiving moves the wedding to weddings_archive, which a status update can't do
+    if update_data.status == WeddingStatus.ARCHIVED:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Use POST /api/weddings/{wedding_id}/archive to archive a wedding"
+        )
+    
     # Check if slug is being changed and is unique
     if update_data.slug and update_data.slug != wedding["slug"]:
-        existing_wedding = await db.weddings.find_one({"slug": update_data.slug})
-        if existing_wedding:
+        if await slug_taken(db, update_data.slug):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Slug already exists"
@@ -128,29 +192,47 @@ async def update_wedding(
             cost_data = calculate_credit_cost(design_key, features)
             update_dict["total_credit_cost"] = cost_data["total_cost"]
     
-    # Update wedding
-    await db.weddings.update_one(
-        {"id": wedding_id},
-        {"$set": update_dict}
+    # Update wedding and get the updated document in the same round trip
+    updated_wedding = await db.weddings.find_one_and_update(
+        {"id": wedding_id, "status": {"$ne": WeddingStatus.ARCHIVED}},
+        {"$set": update_dict, "$inc": {"version": 1}},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_wedding:
+        # Archived (or being archived) or removed after it was loaded above
+        loaders.weddings.clear(wedding_id)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Wedding not found"
+        )
+    loaders.weddings.prime(updated_wedding)
+    await bump_weddings_version(db, wedding["admin_id"], loaders)
     
-    # Fetch updated wedding
-    updated_wedding = await db.weddings.find_one({"id": wedding_id})
     return WeddingResponse(**updated_wedding)
 
 @router.post("/publish", response_model=dict)
 async def publish_wedding(
     publish_request: PublishRequest,
     request: Request,
-    current_admin: dict = Depends(get_current_admin)
+    current_admin: dict = Depends(get_current_admin),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """Publish a wedding (consumes credits)"""
     db = request.app.state.db
     
     wedding_id = publish_request.wedding_id
     
+    return await run_idempotent(
+        db,
+        scope=f"weddings.publish:{current_admin['id']}",
+        key=idempotency_key,
+        fingerprint=wedding_id,
+        handler=lambda: _publish_wedding(db, get_loaders(request), wedding_id, current_admin)
+    )
+
+async def _publish_wedding(db, loaders, wedding_id: str, current_admin: dict) -> dict:
     # Find wedding
-    wedding = await db.weddings.find_one({"id": wedding_id})
+    wedding = await loaders.weddings.load(wedding_id)
     if not wedding:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -184,37 +266,33 @@ async def publish_wedding(
     cost_data = calculate_credit_cost(design_key, features)
     total_cost = cost_data["total_cost"]
     
-    # Check if this is an upgrade (already published before)
-    credits_to_deduct = total_cost
-    if wedding.get("published_at"):
-        # This is an upgrade - only charge the difference
-        previous_cost = wedding.get("total_credit_cost", 0)
-        credits_to_deduct = max(0, total_cost - previous_cost)
+    # Upgrades (already published before) only charge the difference
+    credits_to_deduct = calculate_publish_charge(wedding, total_cost)
     
-    # Check if admin has sufficient credits
-    admin = await db.admins.find_one({"id": current_admin["id"]})
-    available_credits = admin["available_credits"]
+    # Past this point a failed request must not be re-run for its key
+    await begin_writes()
     
-    if available_credits < credits_to_deduct:
+    # Deduct credits atomically, only if the balance covers them
+    admin = await db.admins.find_one_and_update(
+        {"id": current_admin["id"], "available_credits": {"$gte": credits_to_deduct}},
+        {
+            "$inc": {"available_credits": -credits_to_deduct},
+            "$set": {"updated_at": datetime.utcnow()}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    loaders.admins.clear(current_admin["id"])
+    if not admin:
+        current = await db.admins.find_one({"id": current_admin["id"]}, {"_id": 0, "available_credits": 1})
+        available_credits = current["available_credits"] if current else 0
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
             detail=f"Insufficient credits. Required: {credits_to_deduct}, Available: {available_credits}"
         )
+    new_balance = admin["available_credits"]
     
     # Start transaction-like operation
     try:
-        # Deduct credits
-        new_balance = available_credits - credits_to_deduct
-        await db.admins.update_one(
-            {"id": current_admin["id"]},
-            {
-                "$set": {
-                    "available_credits": new_balance,
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
-        
         # Create ledger entry
         ledger_entry = CreditLedger(
             admin_id=current_admin["id"],
@@ -235,9 +313,12 @@ async def publish_wedding(
                     "published_at": datetime.utcnow(),
                     "total_credit_cost": total_cost,
                     "updated_at": datetime.utcnow()
-                }
+                },
+                "$inc": {"version": 1}
             }
         )
+        loaders.weddings.clear(wedding_id)
+        await bump_weddings_version(db, wedding["admin_id"], loaders)
         
         return {
             "message": "Wedding published successfully",
@@ -259,12 +340,18 @@ async def archive_wedding(
     request: Request,
     current_admin: dict = Depends(get_current_admin)
 ):
-    """Archive a wedding"""
+    """Archive a wedding (moves it to the weddings_archive collection)"""
     db = request.app.state.db
+    loaders = get_loaders(request)
     
     # Find wedding
-    wedding = await db.weddings.find_one({"id": wedding_id})
+    wedding = await loaders.weddings.load(wedding_id)
     if not wedding:
+        if await db.weddings_archive.find_one({"id": wedding_id}, {"_id": 1}):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Wedding is already archived"
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Wedding not found"
@@ -278,18 +365,49 @@ async def archive_wedding(
         )
     
     # Archive wedding
-    await db.weddings.update_one(
-        {"id": wedding_id},
-        {
-            "$set": {
-                "status": WeddingStatus.ARCHIVED,
-                "updated_at": datetime.utcnow()
-            }
-        }
-    )
+    archived = await move_to_archive(db, wedding)
+    loaders.weddings.clear(wedding_id)
+    if archived is None:
+        # Archived or removed by another request after it was loaded above
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Wedding not found"
+        )
+    await bump_weddings_version(db, wedding["admin_id"], loaders)
     
     return {"message": "Wedding archived successfully"}
 
+@router.post("/{wedding_id}/restore", response_model=WeddingResponse)
+async def restore_wedding(
+    wedding_id: str,
+    request: Request,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Restore an archived wedding to its status before archiving"""
+    db = request.app.state.db
+    loaders = get_loaders(request)
+    
+    # Find archived wedding
+    wedding = await db.weddings_archive.find_one({"id": wedding_id})
+    if not wedding:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Archived wedding not found"
+        )
+    
+    # Check ownership
+    if wedding["admin_id"] != current_admin["id"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
+    
+    restored_wedding = await restore_from_archive(db, wedding)
+    loaders.weddings.prime(restored_wedding)
+    await bump_weddings_version(db, wedding["admin_id"], loaders)
+    
+    return WeddingResponse(**restored_wedding)
+
 @router.get("/{wedding_id}/estimate", response_model=dict)
 async def estimate_credits(
     wedding_id: str,
@@ -297,10 +415,8 @@ async def estimate_credits(
     current_admin: dict = Depends(get_current_admin)
 ):
     """Get credit estimation for a wedding"""
-    db = request.app.state.db
-    
     # Find wedding
-    wedding = await db.weddings.find_one({"id": wedding_id})
+    wedding = await get_loaders(request).weddings.load(wedding_id)
     if not wedding:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -326,4 +442,129 @@ async def estimate_credits(
         }
     
     cost_data = calculate_credit_cost(design_key, features)
-    return cost_data
\ No newline at end of file
+    return cost_data
+
+WS_AUTH_TIMEOUT_SECONDS = 10
+
+async def _receive_json_object(websocket: WebSocket) -> Optional[dict]:
+    """Receive one text frame holding a JSON object.
+
+    Replies with an error and returns None for binary frames, invalid JSON
+    or non-object payloads; raises WebSocketDisconnect when the client leaves.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+    
+    text = message.get("text")
+    if text is None:
+        await websocket.send_json({"error": "Expected a text frame"})
+        return None
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        await websocket.send_json({"error": "Invalid JSON"})
+        return None
+    if not isinstance(payload, dict):
+        await websocket.send_json({"error": "Expected a JSON object"})
+        return None
+    return payload
+
+@router.websocket("/{wedding_id}/estimate/ws")
+async def estimate_credits_live(
+    websocket: WebSocket,
+    wedding_id: str
+):
+    """Live credit estimation for the wedding editor.
+
+    The first message must be ``{"token": "<jwt>"}``; the token is not taken
+    from the URL so it stays out of access logs. The admin and wedding are
+    loaded once, then each selection change is priced in memory. Clients send
+    ``{"selected_design_key": ..., "selected_features": [...]}`` (either key
+    may be omitted to keep the current value) and receive the cost breakdown
+    plus the publish charge against the previously charged cost.
+
+    ``available_credits`` and the previously charged cost are a snapshot from
+    connect time; send ``{"refresh": true}`` (e.g. after a publish or grant)
+    to re-read them.
+    """
+    db = websocket.app.state.db
+    
+    await websocket.accept()
+    
+    try:
+        auth_message = await asyncio.wait_for(_receive_json_object(websocket), WS_AUTH_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication timed out")
+        return
+    except WebSocketDisconnect:
+        return
+    
+    token = auth_message.get("token") if auth_message else None
+    if not isinstance(token, str):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Expected {\"token\": ...} as first message")
+        return
+    
+    try:
+        current_admin = await authenticate_token(websocket, token)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
+    
+    wedding = await get_loaders(websocket).weddings.load(wedding_id)
+    if not wedding:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Wedding not found")
+        return
+    
+    # Check ownership (unless super admin)
+    if current_admin.get("role") != "SUPER_ADMIN" and wedding["admin_id"] != current_admin["id"]:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Access denied")
+        return
+    
+    design_key = wedding.get("selected_design_key")
+    features = wedding.get("selected_features", [])
+    available_credits = current_admin["available_credits"]
+    
+    def estimate() -> dict:
+        if design_key:
+            cost_data = calculate_credit_cost(design_key, features)
+        else:
+            cost_data = {"design_cost": 0, "features_cost": 0, "total_cost": 0, "breakdown": {}}
+        credits_required = calculate_publish_charge(wedding, cost_data["total_cost"])
+        return {
+            **cost_data,
+            "previous_cost": wedding.get("total_credit_cost", 0) if wedding.get("published_at") else 0,
+            "credits_required": credits_required,
+            "available_credits": available_credits,
+            "sufficient_credits": available_credits >= credits_required
+        }
+    
+    try:
+        await websocket.send_json(estimate())
+        while True:
+            message = await _receive_json_object(websocket)
+            if message is None:
+                continue
+            
+            if message.get("refresh"):
+                admin = await db.admins.find_one({"id": current_admin["id"]}, {"_id": 0, "available_credits": 1})
+                charged = await db.weddings.find_one(
+                    {"id": wedding_id}, {"_id": 0, "published_at": 1, "total_credit_cost": 1}
+                )
+                if admin:
+                    available_credits = admin["available_credits"]
+                if charged:
+                    wedding = {**wedding, **charged}
+            
+            new_design_key = message.get("selected_design_key", design_key)
+            new_features = message.get("selected_features", features)
+            if (new_design_key is not None and not isinstance(new_design_key, str)) or \
+                    not isinstance(new_features, list) or \
+                    not all(isinstance(feature, str) for feature in new_features):
+                await websocket.send_json({"error": "Invalid selection"})
+                continue
+            
+            design_key, features = new_design_key, new_features
+            await websocket.send_json(estimate())
+    except WebSocketDisconnect:
+        pass
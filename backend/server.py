@@ -3,12 +3,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from motor.motor_asyncio import AsyncIOMotorClient
 from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from routes import auth, weddings, credits, admins
+from routes import auth, weddings, credits, admins, profiler
+from profiling import ProfilingMiddleware, MongoCommandListener
+from idempotency import ensure_indexes as ensure_idempotency_indexes
+from reconciliation import ensure_indexes as ensure_ledger_indexes
+from wedding_archive import (
+    ensure_indexes as ensure_archive_indexes, run_archive_sweep
+)
 
 # Database client
 db_client = None
@@ -20,14 +27,21 @@ async def lifespan(app: FastAPI):
     # Startup
     mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017")
     db_name = os.getenv("DATABASE_NAME", "wedding_platform")
-    db_client = AsyncIOMotorClient(mongo_url)
+    db_client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandListener()])
     db = db_client[db_name]
     app.state.db = db
     print(f"Connected to MongoDB: {db_name}")
+    await ensure_idempotency_indexes(db)
+    await ensure_archive_indexes(db)
+    await ensure_ledger_indexes(db)
+    # Move leftover ARCHIVED weddings out of the hot collection without
+    # delaying startup
+    archive_sweep = asyncio.create_task(run_archive_sweep(db))
     
     yield
     
     # Shutdown
+    archive_sweep.cancel()
     if db_client:
         db_client.close()
         print("MongoDB connection closed")
@@ -43,6 +57,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request profiling (disabled until enabled via /api/profiler/settings)
+app.add_middleware(ProfilingMiddleware)
+
 # Health check
 @app.get("/api/health")
 async def health_check():
@@ -53,6 +70,7 @@ app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(admins.router, prefix="/api/admins", tags=["Admins"])
 app.include_router(weddings.router, prefix="/api/weddings", tags=["Weddings"])
 app.include_router(credits.router, prefix="/api/credits", tags=["Credits"])
+app.include_router(profiler.router, prefix="/api/profiler", tags=["Profiler"])
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,123 @@
+"""Idempotency-Key handling for POST /api/weddings/publish.
+
+Runs the app against an in-memory mongomock database with the idempotency
+indexes in place.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+import idempotency
+import server
+from auth_utils import create_access_token
+from models import Admin, Wedding
+
+@pytest.fixture
+def setup():
+    db = AsyncMongoMockClient()["test"]
+    admin = Admin(email="admin@example.com", hashed_password="x", full_name="Admin")
+    weddings = [
+        Wedding(admin_id=admin.id, title=f"Wedding {n}", slug=f"wedding-{n}", selected_design_key="basic")
+        for n in range(2)
+    ]
+
+    async def seed():
+        await idempotency.ensure_indexes(db)
+        await db.admins.insert_one(admin.dict())
+        await db.weddings.insert_many([wedding.dict() for wedding in weddings])
+    asyncio.run(seed())
+
+    previous_db = getattr(server.app.state, "db", None)
+    server.app.state.db = db
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': admin.id})}"}
+    yield TestClient(server.app), db, headers, admin, [wedding.id for wedding in weddings]
+    server.app.state.db = previous_db
+
+def publish(client, headers, wedding_id, key):
+    return client.post(
+        "/api/weddings/publish",
+        json={"wedding_id": wedding_id},
+        headers={**headers, "Idempotency-Key": key}
+    )
+
+def test_retry_replays_without_charging_again(setup):
+    client, db, headers, admin, wedding_ids = setup
+
+    first = publish(client, headers, wedding_ids[0], "key-1")
+    retry = publish(client, headers, wedding_ids[0], "key-1")
+
+    assert first.status_code == 200
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert asyncio.run(db.credit_ledger.count_documents({})) == 1
+    stored = asyncio.run(db.admins.find_one({"id": admin.id}))
+    assert stored["available_credits"] == first.json()["remaining_credits"]
+
+def test_key_reused_with_different_body_is_rejected(setup):
+    client, db, headers, _, wedding_ids = setup
+
+    assert publish(client, headers, wedding_ids[0], "key-1").status_code == 200
+    response = publish(client, headers, wedding_ids[1], "key-1")
+
+    assert response.status_code == 422
+    assert asyncio.run(db.credit_ledger.count_documents({})) == 1
+
+def test_expired_lease_after_writes_settles_as_error(setup):
+    client, db, headers, admin, wedding_ids = setup
+    # A request that died after begin_writes and whose lease ran out
+    asyncio.run(db.idempotency_keys.insert_one({
+        "scope": f"weddings.publish:{admin.id}",
+        "key": "key-1",
+        "fingerprint": wedding_ids[0],
+        "owner": "dead-worker",
+        "state": idempotency.IN_PROGRESS,
+        "writes_started": True,
+        "locked_until": datetime.utcnow() - timedelta(seconds=1),
+        "created_at": datetime.utcnow() - timedelta(minutes=5)
+    }))
+
+    response = publish(client, headers, wedding_ids[0], "key-1")
+    replay = publish(client, headers, wedding_ids[0], "key-1")
+
+    assert response.status_code == 500
+    assert replay.status_code == 500
+    assert asyncio.run(db.credit_ledger.count_documents({})) == 0
+
+def test_expired_lease_before_writes_is_taken_over(setup):
+    client, db, headers, admin, wedding_ids = setup
+    asyncio.run(db.idempotency_keys.insert_one({
+        "scope": f"weddings.publish:{admin.id}",
+        "key": "key-1",
+        "fingerprint": wedding_ids[0],
+        "owner": "dead-worker",
+        "state": idempotency.IN_PROGRESS,
+        "locked_until": datetime.utcnow() - timedelta(seconds=1),
+        "created_at": datetime.utcnow() - timedelta(minutes=5)
+    }))
+
+    response = publish(client, headers, wedding_ids[0], "key-1")
+
+    assert response.status_code == 200
+    assert asyncio.run(db.credit_ledger.count_documents({})) == 1
+
+def test_result_is_not_stored_after_losing_the_claim():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        await idempotency.ensure_indexes(db)
+
+        async def handler():
+            # Another request takes the key over while this one runs
+            await db.idempotency_keys.update_one({"key": "key-1"}, {"$set": {"owner": "other"}})
+            return {"ok": True}
+
+        response = await idempotency.run_idempotent(db, "scope", "key-1", "fingerprint", handler)
+        return response, await db.idempotency_keys.find_one({"key": "key-1"})
+
+    response, record = asyncio.run(run())
+
+    assert response == {"ok": True}
+    assert record["state"] == idempotency.IN_PROGRESS
+    assert record["owner"] == "other"
@@ -0,0 +1,110 @@
+"""Ledger reconciliation against an in-memory mongomock database."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from models import Admin, CreditLedger, CreditTransactionType
+from reconciliation import ensure_indexes, reconcile_ledger, _repair_drift
+
+START = datetime(2024, 1, 1)
+
+def ledger(admin_id: str, entries):
+    """Ledger documents for (transaction_type, amount, balance_after) tuples, one minute apart"""
+    return [
+        CreditLedger(
+            admin_id=admin_id,
+            transaction_type=transaction_type,
+            amount=amount,
+            balance_after=balance_after,
+            description="test",
+            created_at=START + timedelta(minutes=n)
+        ).dict()
+        for n, (transaction_type, amount, balance_after) in enumerate(entries)
+    ]
+
+@pytest.fixture
+def seeded():
+    db = AsyncMongoMockClient()["test"]
+    admins = {
+        # Gap at the second entry (100 - 30 != 80) and drift (130 vs 150)
+        "drifted": Admin(email="drifted@example.com", hashed_password="x", full_name="Drifted", available_credits=150),
+        # Overdrawn, in the ledger and on the admin
+        "overdrawn": Admin(email="overdrawn@example.com", hashed_password="x", full_name="Overdrawn", available_credits=-10),
+        # Negative balance without any ledger entries
+        "unledgered": Admin(email="unledgered@example.com", hashed_password="x", full_name="Unledgered", available_credits=-5),
+        "clean": Admin(email="clean@example.com", hashed_password="x", full_name="Clean", available_credits=60)
+    }
+    entries = (
+        ledger(admins["drifted"].id, [
+            (CreditTransactionType.CREDIT, 100, 100),
+            (CreditTransactionType.DEDUCT, 30, 80),
+            (CreditTransactionType.CREDIT, 50, 130)
+        ])
+        + ledger(admins["overdrawn"].id, [
+            (CreditTransactionType.CREDIT, 10, 10),
+            (CreditTransactionType.DEDUCT, 20, -10)
+        ])
+        + ledger(admins["clean"].id, [
+            (CreditTransactionType.CREDIT, 100, 100),
+            (CreditTransactionType.DEDUCT, 40, 60)
+        ])
+    )
+
+    async def seed():
+        await ensure_indexes(db)
+        await db.admins.insert_many([admin.dict() for admin in admins.values()])
+        await db.credit_ledger.insert_many(entries)
+    asyncio.run(seed())
+    return db, {name: admin.id for name, admin in admins.items()}
+
+def issues_of(report: dict, issue_type: str):
+    return [issue for issue in report["issues"] if issue["type"] == issue_type]
+
+def test_report_finds_gaps_drift_and_negative_balances(seeded):
+    db, ids = seeded
+
+    report = asyncio.run(reconcile_ledger(db, concurrency=2))
+
+    assert report["admins_checked"] == 4
+    assert report["ledger_entries_scanned"] == 7
+    assert report["gaps"] == 1
+    assert issues_of(report, "gap")[0]["admin_id"] == ids["drifted"]
+    assert issues_of(report, "gap")[0]["expected_balance_after"] == 70
+    assert report["admins_with_drift"] == 1
+    assert issues_of(report, "drift") == [{
+        "type": "drift",
+        "admin_id": ids["drifted"],
+        "available_credits": 150,
+        "ledger_balance": 130
+    }]
+    assert report["negative_balances"] == 3
+    negative = issues_of(report, "negative_balance")
+    assert sorted(issue["admin_id"] for issue in negative) == sorted([ids["overdrawn"], ids["overdrawn"], ids["unledgered"]])
+    assert report["repaired"] == 0
+    assert asyncio.run(db.credit_ledger.count_documents({})) == 7
+
+def test_repair_appends_adjustment_entry(seeded):
+    db, ids = seeded
+
+    report = asyncio.run(reconcile_ledger(db, repair=True))
+    adjustment = asyncio.run(db.credit_ledger.find_one({"description": "Reconciliation adjustment"}))
+    rerun = asyncio.run(reconcile_ledger(db))
+
+    assert report["repaired"] == 1
+    assert adjustment["admin_id"] == ids["drifted"]
+    assert adjustment["transaction_type"] == CreditTransactionType.CREDIT
+    assert adjustment["amount"] == 20
+    assert adjustment["balance_after"] == 150
+    assert rerun["admins_with_drift"] == 0
+
+def test_repair_skipped_when_ledger_changed(seeded):
+    db, ids = seeded
+
+    async def repair_with_stale_entry():
+        first = await db.credit_ledger.find_one({"admin_id": ids["drifted"]}, sort=[("created_at", 1)])
+        return await _repair_drift(db, ids["drifted"], 150, first)
+
+    assert asyncio.run(repair_with_stale_entry()) is False
+    assert asyncio.run(db.credit_ledger.count_documents({"description": "Reconciliation adjustment"})) == 0
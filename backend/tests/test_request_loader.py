@@ -0,0 +1,100 @@
+"""Count Mongo operations per route to check the request-scoped loader.
+
+The app runs against an in-memory mongomock database wrapped so that every
+collection call is counted by (collection, operation).
+"""
+import asyncio
+from collections import Counter
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from auth_utils import create_access_token
+from models import Admin, Wedding
+
+READ_OPS = {"find_one", "find"}
+
+class CountingCollection:
+    def __init__(self, collection, counts: Counter):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counts[(self._collection.name, name)] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+class CountingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self.counts = Counter()
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._db, name), self.counts)
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+    def reads(self, collection: str) -> int:
+        return sum(n for (coll, op), n in self.counts.items() if coll == collection and op in READ_OPS)
+
+@pytest.fixture
+def setup():
+    raw_db = AsyncMongoMockClient()["test"]
+    admin = Admin(email="admin@example.com", hashed_password="x", full_name="Admin")
+    wedding = Wedding(admin_id=admin.id, title="Wedding", slug="wedding", selected_design_key="basic")
+
+    async def seed():
+        await raw_db.admins.insert_one(admin.dict())
+        await raw_db.weddings.insert_one(wedding.dict())
+    asyncio.run(seed())
+
+    db = CountingDatabase(raw_db)
+    previous_db = getattr(server.app.state, "db", None)
+    server.app.state.db = db
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': admin.id})}"}
+    yield TestClient(server.app), db, headers, wedding.id
+    server.app.state.db = previous_db
+
+def test_publish_reads_admin_once(setup):
+    client, db, headers, wedding_id = setup
+
+    response = client.post("/api/weddings/publish", json={"wedding_id": wedding_id}, headers=headers)
+
+    assert response.status_code == 200
+    # Baseline: 2 admins reads (get_current_admin, then a re-read in publish)
+    assert db.reads("admins") == 1
+    assert db.reads("weddings") == 1
+
+def test_update_wedding_does_not_reread(setup):
+    client, db, headers, wedding_id = setup
+
+    response = client.put(f"/api/weddings/{wedding_id}", json={"title": "Renamed"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["title"] == "Renamed"
+    # Baseline: 2 weddings reads (before and after the update)
+    assert db.reads("weddings") == 1
+    assert db.counts[("weddings", "find_one_and_update")] == 1
+    assert db.counts[("weddings", "update_one")] == 0
+
+def test_concurrent_loads_are_coalesced(setup):
+    _, db, _, wedding_id = setup
+    from loaders import DocumentLoader
+
+    async def load_twice():
+        loader = DocumentLoader(db.weddings)
+        return await asyncio.gather(loader.load(wedding_id), loader.load("missing"), loader.load(wedding_id))
+
+    wedding, missing, again = asyncio.run(load_twice())
+
+    assert wedding["id"] == wedding_id and missing is None and again is wedding
+    assert db.counts[("weddings", "find")] == 1
+    assert db.counts[("weddings", "find_one")] == 0
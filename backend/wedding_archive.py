@@ -0,0 +1,119 @@
+from datetime import datetime
+from pymongo import ReturnDocument
+from models import WeddingStatus
+from etags import bump_weddings_version
+
+async def ensure_indexes(db):
+    """Indexes for the cold weddings_archive collection"""
+    await db.weddings_archive.create_index("id", unique=True)
+    await db.weddings_archive.create_index("slug", unique=True)
+    await db.weddings_archive.create_index("admin_id")
+    # Only ARCHIVED documents still in the hot collection are indexed, so the
+    # sweep's lookup stays cheap and the index is normally empty
+    await db.weddings.create_index(
+        "status",
+        name="archived_status",
+        partialFilterExpression={"status": WeddingStatus.ARCHIVED.value}
+    )
+
+async def slug_taken(db, slug: str) -> bool:
+    """Slugs stay reserved while their wedding is archived"""
+    if await db.weddings.find_one({"slug": slug}, {"_id": 1}):
+        return True
+    return bool(await db.weddings_archive.find_one({"slug": slug}, {"_id": 1}))
+
+async def move_to_archive(db, wedding: dict):
+    """Move a wedding from the hot weddings collection to weddings_archive.
+
+    The hot copy is marked ARCHIVED first, so a move interrupted before the
+    hot delete is picked up and finished by sweep_archived_weddings. The
+    archived copy is the document returned by that write, so updates made
+    after the caller loaded ``wedding`` are kept. Returns None if the wedding
+    left the hot collection in the meantime.
+    """
+    if wedding["status"] != WeddingStatus.ARCHIVED:
+        now = datetime.utcnow()
+        wedding = await db.weddings.find_one_and_update(
+            {"id": wedding["id"], "status": {"$ne": WeddingStatus.ARCHIVED}},
+            [{
+                "$set": {
+                    "archived_from_status": "$status",
+                    "status": WeddingStatus.ARCHIVED.value,
+                    "archived_at": now,
+                    "updated_at": now,
+                    "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+                }
+            }],
+            return_document=ReturnDocument.AFTER
+        )
+        if wedding is None:
+            return None
+
+    archived = {k: v for k, v in wedding.items() if k != "_id"}
+    archived.setdefault("archived_at", datetime.utcnow())
+    await db.weddings_archive.replace_one({"id": wedding["id"]}, archived, upsert=True)
+    await db.weddings.delete_one({"id": wedding["id"]})
+    return archived
+
+async def restore_from_archive(db, wedding: dict):
+    """Move an archived wedding back to the hot collection"""
+    restored = {
+        k: v for k, v in wedding.items()
+        if k not in ("_id", "archived_at", "archived_from_status")
+    }
+    restored["status"] = wedding.get("archived_from_status") or WeddingStatus.DRAFT
+    restored["updated_at"] = datetime.utcnow()
+    restored["version"] = wedding.get("version", 0) + 1
+
+    await db.weddings.replace_one({"id": wedding["id"]}, restored, upsert=True)
+    await db.weddings_archive.delete_one({"id": wedding["id"]})
+    return restored
+
+async def sweep_archived_weddings(db) -> int:
+    """Move any ARCHIVED weddings still in the hot collection to the archive.
+
+    Covers weddings archived before tiered storage existed and moves that
+    were interrupted between the archive write and the hot delete.
+    """
+    moved = 0
+    async for wedding in db.weddings.find({"status": WeddingStatus.ARCHIVED.value}):
+        await move_to_archive(db, wedding)
+        await bump_weddings_version(db, wedding["admin_id"])
+        moved += 1
+    return moved
+
+async def run_archive_sweep(db):
+    """Background wrapper for sweep_archived_weddings that logs its outcome"""
+    try:
+        moved = await sweep_archived_weddings(db)
+    except Exception as e:
+        print(f"Archive sweep failed: {e}")
+        return
+    if moved:
+        print(f"Moved {moved} archived weddings to weddings_archive")
+
+async def find_wedding(db, wedding_id: str, projection: dict = None):
+    """Find a wedding in the hot collection, falling back to the archive"""
+    wedding = await db.weddings.find_one({"id": wedding_id}, projection)
+    if wedding is None:
+        wedding = await db.weddings_archive.find_one({"id": wedding_id}, projection)
+    return wedding
+
+if __name__ == "__main__":
+    import asyncio
+    import os
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv()
+
+    async def main():
+        client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+        try:
+            db = client[os.getenv("DATABASE_NAME", "wedding_platform")]
+            await ensure_indexes(db)
+            print(f"Moved {await sweep_archived_weddings(db)} archived weddings to weddings_archive")
+        finally:
+            client.close()
+
+    asyncio.run(main())